@@ -0,0 +1,460 @@
+"""Shared data layer for the dashboard: HTTP session, caches, numba kernels, streaming state."""
+import streamlit as st
+import pandas as pd
+import numpy as np
+import requests
+import orjson
+import httpx
+import asyncio
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import diskcache
+import threading
+import time
+import os
+import tempfile
+from collections import deque
+from numba import njit
+from datetime import datetime, timedelta
+from pathlib import Path
+
+# ------------------- API SETUP (Optimized) ------------------- #
+COINGECKO_API = "https://api.coingecko.com/api/v3"
+BINANCE_API = "https://api.binance.com/api/v3"
+EXPORT_WORKERS = 8
+OHLC_TTL = 900  # Seconds before cached OHLC is considered stale
+
+# Shared keep-alive session: reuses TLS connections and retries CoinGecko's frequent 429s.
+# Up to 3 retries with short backoff; Retry-After is ignored because it can ask for minutes
+# of sleep while the caller holds a _rate_limit slot.
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=16,
+    pool_maxsize=16,
+    max_retries=Retry(
+        total=3,
+        backoff_factor=0.3,
+        status_forcelist=[429, 502, 503, 504],
+        respect_retry_after_status=False
+    )
+))
+_rate_limit = threading.Semaphore(5)  # Max concurrent OHLC requests (CoinGecko rate limit)
+_disk = diskcache.Cache("./.ohlc_cache")  # Survives restarts, unlike st.cache_data
+COINS_PARQUET = Path(".coins.parquet")
+COINS_MAX_AGE = 86400  # Seconds before the on-disk coin list is refetched
+TOP_IDS_RETRY_AFTER = 60  # Seconds to wait after a failed /coins/markets call before retrying
+_top_ids_failed_at = 0.0
+
+@st.cache_data(ttl=3600)
+def get_all_coins():
+    """Fetch all CoinGecko coins, persisted as parquet so cold starts skip the HTTP call."""
+    if COINS_PARQUET.exists() and time.time() - COINS_PARQUET.stat().st_mtime < COINS_MAX_AGE:
+        df = _read_coins_parquet()
+        if df is not None:
+            return df
+    try:
+        url = f"{COINGECKO_API}/coins/list"
+        r = SESSION.get(url, timeout=10)
+        r.raise_for_status()
+        df = pd.DataFrame.from_records(orjson.loads(r.content))
+        # Lowercased once here so the sidebar search can use plain substring matching
+        df['_name_lc'] = df['name'].str.lower()
+        df['_sym_lc'] = df['symbol'].str.lower()
+    except Exception as e:
+        df = _read_coins_parquet()
+        if df is not None:
+            return df  # Stale list beats no list
+        st.error(f"CoinGecko API error: {str(e)}")
+        return pd.DataFrame(columns=['id', 'symbol', 'name', '_name_lc', '_sym_lc'])
+    _write_coins_parquet(df)
+    return df
+
+def _read_coins_parquet():
+    """The persisted coin list, or None if it's missing or unreadable (e.g. truncated)."""
+    try:
+        return pd.read_parquet(COINS_PARQUET)
+    except Exception:
+        return None
+
+def _write_coins_parquet(df):
+    """Best-effort atomic write: readers see the old file or the new one, never a partial one."""
+    tmp = None
+    try:
+        fd, tmp = tempfile.mkstemp(dir=COINS_PARQUET.parent, prefix=COINS_PARQUET.name + ".", suffix=".tmp")
+        os.close(fd)
+        df.to_parquet(tmp, index=False)
+        os.replace(tmp, COINS_PARQUET)
+    except Exception:
+        # Read-only or full disk: the in-memory list is still returned, just not persisted
+        if tmp is not None:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+
+@st.cache_data(ttl=3600)
+def get_top_coin_ids(limit=250):
+    """Fetch the top coins by market cap (used for short searches). Errors propagate so they aren't cached."""
+    url = f"{COINGECKO_API}/coins/markets?vs_currency=usd&order=market_cap_desc&per_page={limit}&page=1"
+    r = SESSION.get(url, timeout=10)
+    r.raise_for_status()
+    return [coin['id'] for coin in orjson.loads(r.content)]
+
+@st.cache_data(ttl=OHLC_TTL, show_spinner=False)
+def get_ohlc_data(coin_id, days=14):
+    """
+    Fetch OHLC data from disk cache → CoinGecko → fallback to Binance if needed.
+    Returns: DataFrame with columns [timestamp, open, high, low, close]
+    (df.attrs['source'] records which API, and so which candle interval, it came from)
+    """
+    df = _disk.get((coin_id, days))
+    if df is not None and not df.empty:
+        return df
+    with _rate_limit:
+        df = _fetch_ohlc(coin_id, days)
+    if not df.empty:
+        _disk.set((coin_id, days), df, expire=3600)
+    return df
+
+def get_latest_ohlc(coin_id):
+    """Uncached fetch of the most recent bars (3 days keeps CoinGecko's 4h granularity)."""
+    with _rate_limit:
+        return _fetch_ohlc(coin_id, 3)
+
+def _check_ohlc_payload(data, source):
+    """Error bodies come back as JSON objects (or empty lists); don't let them pass as data."""
+    if not isinstance(data, list) or not data:
+        raise ValueError(f"No OHLC data from {source}: {str(data)[:200]}")
+
+def _coingecko_ohlc_frame(data):
+    """CoinGecko /ohlc rows → DataFrame with columns [timestamp, open, high, low, close]."""
+    _check_ohlc_payload(data, "CoinGecko")
+    df = pd.DataFrame(data, columns=['timestamp', 'open', 'high', 'low', 'close'])
+    df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms')
+    df.attrs['source'] = "coingecko"  # 4h candles stamped at close (for 3-30 days)
+    return df
+
+def _binance_ohlc_frame(data):
+    """Binance /klines rows → DataFrame with columns [timestamp, open, high, low, close]."""
+    _check_ohlc_payload(data, "Binance")
+    # Klines have 12 fields; only parse the first 5 (timestamp + OHLC) in one float cast
+    arr = np.asarray([row[:5] for row in data], dtype=np.float64)
+    df = pd.DataFrame(arr, columns=['timestamp', 'open', 'high', 'low', 'close'])
+    df['timestamp'] = pd.to_datetime(df['timestamp'].astype('int64'), unit='ms')
+    df.attrs['source'] = "binance"  # 1d candles stamped at open
+    return df
+
+def _fetch_ohlc(coin_id, days):
+    """Unthrottled OHLC fetch; call through get_ohlc_data."""
+    try:
+        # Try CoinGecko first
+        url = f"{COINGECKO_API}/coins/{coin_id}/ohlc?vs_currency=usd&days={days}"
+        r = SESSION.get(url, timeout=10)
+        r.raise_for_status()
+        return _coingecko_ohlc_frame(orjson.loads(r.content))
+    except:
+        # Fallback to Binance
+        symbol = "BTCUSDT" if coin_id == "bitcoin" else f"{coin_id.upper()}USDT"
+        end_time = datetime.now()
+        start_time = end_time - timedelta(days=days)
+        url = f"{BINANCE_API}/klines?symbol={symbol}&interval=1d&startTime={int(start_time.timestamp()*1000)}&endTime={int(end_time.timestamp()*1000)}"
+        r = SESSION.get(url, timeout=10)
+        r.raise_for_status()
+        return _binance_ohlc_frame(orjson.loads(r.content))
+
+async def _limited_get(client, url):
+    """GET through the same _rate_limit slots as the foreground fetches, so prefetch never adds to the load."""
+    await asyncio.to_thread(_rate_limit.acquire)
+    try:
+        return await client.get(url)
+    finally:
+        _rate_limit.release()
+
+async def _prefetch(coin_ids, days=14):
+    """Fetch CoinGecko OHLC for several coins concurrently over HTTP/2 and store it in the disk cache."""
+    async with httpx.AsyncClient(http2=True, timeout=10) as client:
+        responses = await asyncio.gather(
+            *[_limited_get(client, f"{COINGECKO_API}/coins/{coin_id}/ohlc?vs_currency=usd&days={days}") for coin_id in coin_ids],
+            return_exceptions=True
+        )
+    for coin_id, r in zip(coin_ids, responses):
+        if isinstance(r, Exception) or r.status_code != 200:
+            continue  # Best effort: a miss just means get_ohlc_data fetches it later
+        try:
+            df = _coingecko_ohlc_frame(orjson.loads(r.content))
+        except ValueError:
+            continue
+        _disk.set((coin_id, days), df, expire=3600)
+
+def prefetch_ohlc(coin_ids, days=14):
+    """Warm the disk cache for coin_ids in a background thread."""
+    missing = [coin_id for coin_id in coin_ids if (coin_id, days) not in _disk]
+    if missing:
+        threading.Thread(target=lambda: asyncio.run(_prefetch(missing, days)), daemon=True).start()
+
+# ------------------- CORE CALCULATIONS (Upgraded) ------------------- #
+@njit(cache=True, inline='always')
+def _atr_wilder(high, low, close, n):
+    """Wilder-smoothed ATR in one pass (SMA seed over the first n bars, like TradingView's RMA)."""
+    atr = high[0] - low[0]
+    for i in range(1, len(high)):
+        tr = max(high[i] - low[i], abs(high[i] - close[i - 1]), abs(low[i] - close[i - 1]))
+        if i >= n:
+            atr = (atr * (n - 1) + tr) / n
+        else:
+            atr += (tr - atr) / (i + 1)
+    return atr
+
+@njit(cache=True)
+def _atr_wilder_14(high, low, close):
+    """_atr_wilder inlined with n=14 as a literal, so the window constants fold at compile time."""
+    return _atr_wilder(high, low, close, 14)
+
+def calculate_atr(df, window=14):
+    """Calculate ATR(14) from OHLC data (Wilder smoothing, as TradingView does)."""
+    if len(df) == 0:
+        raise ValueError("Cannot calculate ATR from empty OHLC data")
+    ohlc = df[['high', 'low', 'close']].to_numpy(dtype=np.float64)
+    if window == 14:
+        return _atr_wilder_14(ohlc[:, 0], ohlc[:, 1], ohlc[:, 2])  # Return latest ATR(14)
+    return _atr_wilder(ohlc[:, 0], ohlc[:, 1], ohlc[:, 2], window)
+
+def log_returns(df):
+    """Log returns of the close column as a plain numpy array."""
+    c = df['close'].to_numpy(dtype=np.float64)
+    return np.log(c[1:] / c[:-1])
+
+@njit(cache=True)
+def _beta(alt, btc):
+    """cov(alt, btc) / var(btc) from running sums in a single pass."""
+    n = len(alt)
+    sa = sb = sab = sbb = 0.0
+    for i in range(n):
+        x = alt[i]
+        y = btc[i]
+        sa += x
+        sb += y
+        sab += x * y
+        sbb += y * y
+    ma = sa / n
+    mb = sb / n
+    cov = sab / n - ma * mb
+    var = sbb / n - mb * mb
+    return cov / var if var != 0 else 0.0
+
+def align_ohlc(btc_ohlc, alt_ohlc):
+    """Restrict BTC and alt OHLC to the bars they share, matched on timestamp."""
+    if btc_ohlc.attrs.get('source') != alt_ohlc.attrs.get('source'):
+        raise ValueError(
+            f"OHLC sources differ (BTC {btc_ohlc.attrs.get('source')} vs alt {alt_ohlc.attrs.get('source')}); "
+            "candle intervals don't line up"
+        )
+    btc = btc_ohlc[btc_ohlc['timestamp'].isin(alt_ohlc['timestamp'])].reset_index(drop=True)
+    alt = alt_ohlc[alt_ohlc['timestamp'].isin(btc_ohlc['timestamp'])].reset_index(drop=True)
+    if len(btc) < 2:
+        raise ValueError(f"Only {len(btc)} overlapping bars between BTC and alt")
+    return btc, alt
+
+def calculate_beta(btc_returns, alt_returns):
+    """Beta of the altcoin vs BTC: cov(alt, btc) / var(btc)."""
+    btc = np.asarray(btc_returns, dtype=np.float64)
+    alt = np.asarray(alt_returns, dtype=np.float64)
+    if len(btc) != len(alt) or len(btc) == 0:
+        raise ValueError(f"Return series length mismatch: BTC {len(btc)} vs alt {len(alt)}")
+    return _beta(alt, btc)
+
+@njit(cache=True)
+def _atr_vol(high, low, close, n=14):
+    """ATR(n)/Close in percent, from one pass over the bars."""
+    atr = _atr_wilder_14(high, low, close) if n == 14 else _atr_wilder(high, low, close, n)
+    return atr / close[-1] * 100.0
+
+def calculate_pair_beta(btc_ohlc, alt_ohlc):
+    """Beta from two OHLC frames, aligned on timestamp before taking returns."""
+    btc, alt = align_ohlc(btc_ohlc, alt_ohlc)
+    return calculate_beta(log_returns(btc), log_returns(alt))
+
+def calculate_volatility(ohlc):
+    """ATR(14)/Close in percent for one coin."""
+    if len(ohlc) == 0:
+        raise ValueError("Cannot calculate volatility from empty OHLC data")
+    bars = ohlc[['high', 'low', 'close']].to_numpy(dtype=np.float64)
+    return _atr_vol(bars[:, 0], bars[:, 1], bars[:, 2])
+
+def calculate_volatility_multiplier(btc_ohlc, alt_ohlc, btc_vol=None):
+    """TradingView-style: (ATR(14)/Close) for altcoin ÷ BTC. Pass btc_vol to reuse a precomputed BTC value."""
+    if btc_vol is None:
+        btc_vol = calculate_volatility(btc_ohlc)
+    alt_vol = calculate_volatility(alt_ohlc)
+    return alt_vol / btc_vol if btc_vol != 0 else 0
+
+# ------------------- STREAMING STATE (Live Refresh) ------------------- #
+@njit(cache=True)
+def _welford_push(mean_a, mean_b, cov, var, n, a, b):
+    """Add one (alt, btc) return pair to the running co-moments."""
+    n += 1
+    db = b - mean_b
+    mean_a += (a - mean_a) / n
+    mean_b += db / n
+    cov += (a - mean_a) * db
+    var += (b - mean_b) * db
+    return mean_a, mean_b, cov, var, n
+
+@njit(cache=True)
+def _welford_pop(mean_a, mean_b, cov, var, n, a, b):
+    """Remove one (alt, btc) return pair from the running co-moments."""
+    if n <= 1:
+        return 0.0, 0.0, 0.0, 0.0, 0
+    n -= 1
+    new_mean_a = mean_a + (mean_a - a) / n
+    new_mean_b = mean_b + (mean_b - b) / n
+    cov -= (a - mean_a) * (b - new_mean_b)
+    var -= (b - mean_b) * (b - new_mean_b)
+    return new_mean_a, new_mean_b, cov, var, n
+
+class BetaState:
+    """Sliding-window beta of alt vs BTC log returns over timestamp-aligned bars, O(1) per new bar."""
+    __slots__ = ('mean_a', 'mean_b', 'cov', 'var', 'n', 'window', 'last_btc', 'last_alt', 'last_ts')
+
+    def __init__(self, btc_ohlc, alt_ohlc):
+        btc_ohlc, alt_ohlc = align_ohlc(btc_ohlc, alt_ohlc)  # Same rule as calculate_pair_beta
+        self.mean_a = self.mean_b = self.cov = self.var = 0.0
+        self.n = 0
+        self.window = deque()
+        for b, a in zip(log_returns(btc_ohlc), log_returns(alt_ohlc)):
+            self._push(a, b)
+        self.window = deque(self.window, maxlen=len(self.window) or None)
+        self.last_btc = float(btc_ohlc['close'].iloc[-1])
+        self.last_alt = float(alt_ohlc['close'].iloc[-1])
+        self.last_ts = btc_ohlc['timestamp'].iloc[-1]
+
+    def _push(self, a, b):
+        self.mean_a, self.mean_b, self.cov, self.var, self.n = _welford_push(
+            self.mean_a, self.mean_b, self.cov, self.var, self.n, a, b)
+        self.window.append((a, b))
+
+    def push(self, btc_ret, alt_ret):
+        if self.window.maxlen and len(self.window) == self.window.maxlen:
+            old_a, old_b = self.window.popleft()
+            self.mean_a, self.mean_b, self.cov, self.var, self.n = _welford_pop(
+                self.mean_a, self.mean_b, self.cov, self.var, self.n, old_a, old_b)
+        self._push(alt_ret, btc_ret)
+
+    def update(self, btc_ohlc, alt_ohlc):
+        btc_new = btc_ohlc[btc_ohlc['timestamp'] > self.last_ts]
+        alt_new = alt_ohlc[alt_ohlc['timestamp'] > self.last_ts]
+        # Inner-join on timestamp: only bars both series have advance the beta, so return pairs stay aligned
+        joined = btc_new.merge(alt_new, on='timestamp', suffixes=('_btc', '_alt')).sort_values('timestamp')
+        for bar in joined.itertuples(index=False):
+            self.push(np.log(bar.close_btc / self.last_btc), np.log(bar.close_alt / self.last_alt))
+            self.last_btc = bar.close_btc
+            self.last_alt = bar.close_alt
+            self.last_ts = bar.timestamp
+
+    @property
+    def beta(self):
+        return self.cov / self.var if self.var != 0 else 0.0
+
+class ATRState:
+    """Wilder ATR carried forward one bar at a time."""
+    __slots__ = ('atr', 'last_close', 'last_ts', 'n', 'source')
+
+    def __init__(self, ohlc, window=14):
+        self.atr = calculate_atr(ohlc, window)
+        self.source = ohlc.attrs.get('source')
+        self.last_close = float(ohlc['close'].iloc[-1])
+        self.last_ts = ohlc['timestamp'].iloc[-1]
+        self.n = window
+
+    def push(self, ts, high, low, close):
+        tr = max(high - low, abs(high - self.last_close), abs(low - self.last_close))
+        self.atr = (self.atr * (self.n - 1) + tr) / self.n
+        self.last_close = close
+        self.last_ts = ts
+
+    def update(self, ohlc):
+        for bar in ohlc[ohlc['timestamp'] > self.last_ts].itertuples(index=False):
+            self.push(bar.timestamp, bar.high, bar.low, bar.close)
+
+class LiveState:
+    """
+    Per-coin streaming state: seeded by a full calculation, then fed only newer bars.
+    Follows the same rules as the export: ATR uses each coin's full series,
+    beta only the timestamp-aligned bars (and is unavailable if the sources differ).
+    """
+    __slots__ = ('btc', 'alt', 'beta', 'beta_error', 'checked_at')
+
+    def __init__(self, btc_ohlc, alt_ohlc):
+        self.btc = ATRState(btc_ohlc)
+        self.alt = ATRState(alt_ohlc)
+        try:
+            self.beta, self.beta_error = BetaState(btc_ohlc, alt_ohlc), None
+        except ValueError as e:
+            self.beta, self.beta_error = None, str(e)
+        self.checked_at = time.monotonic()
+
+    def is_stale(self):
+        return time.monotonic() - self.checked_at > OHLC_TTL
+
+    def update(self, btc_ohlc, alt_ohlc):
+        """Fold in newer bars. Returns False, leaving the state untouched, if the bars come from another source/interval."""
+        if btc_ohlc.attrs.get('source') != self.btc.source or alt_ohlc.attrs.get('source') != self.alt.source:
+            return False
+        self.checked_at = time.monotonic()
+        self.btc.update(btc_ohlc)
+        self.alt.update(alt_ohlc)
+        if self.beta is not None:
+            self.beta.update(btc_ohlc, alt_ohlc)
+        return True
+
+    def result(self, mode):
+        if mode == "Beta":
+            if self.beta is None:
+                raise ValueError(self.beta_error)
+            return self.beta.beta
+        btc_vol = self.btc.atr / self.btc.last_close
+        alt_vol = self.alt.atr / self.alt.last_close
+        return alt_vol / btc_vol if btc_vol != 0 else 0
+
+# ------------------- JIT WARMUP ------------------- #
+def _warm_jit():
+    """
+    Compile every kernel through the real entry points so the first dashboard calculation
+    doesn't pay the compile cost. Frames come from the real CoinGecko/Binance builders, so the
+    arrays the kernels see (layout, and read-only under pandas copy-on-write) match live data.
+    """
+    start = 1_700_000_000_000
+    closes = np.linspace(1.0, 2.0, 21)
+    rows = [[start + i * 14_400_000, c, c + 0.5, c - 0.5, c] for i, c in enumerate(closes)]
+    for build in (_coingecko_ohlc_frame, _binance_ohlc_frame):
+        seed, full = build(rows[:-1]), build(rows)
+        calculate_atr(seed, 20)
+        calculate_volatility_multiplier(seed, seed)
+        calculate_pair_beta(seed, seed)
+        state = LiveState(seed, seed)
+        state.update(full, full)  # Full window: exercises the Welford pop as well as push
+
+_warm_jit()
+
+# ------------------- COIN SEARCH ------------------- #
+def filter_coin_ids(search: str) -> list[str]:
+    """Coin IDs matching the search."""
+    global _top_ids_failed_at
+    top_ids = None
+    if len(search) < 3 and time.monotonic() - _top_ids_failed_at > TOP_IDS_RETRY_AFTER:
+        # Short searches match thousands of coins; only offer the top ones by market cap
+        try:
+            top_ids = tuple(get_top_coin_ids())
+        except Exception:
+            # Remember the failure briefly so every rerun doesn't block on (and add to) the rate limit
+            _top_ids_failed_at = time.monotonic()
+    return _filter_coin_ids(search, top_ids)
+
+@st.cache_data(ttl=3600)
+def _filter_coin_ids(search, top_ids):
+    """Memoized filter, so other widget changes skip the mask + tolist()."""
+    coins = get_all_coins()
+    if top_ids:
+        coins = coins.set_index('id').reindex(list(top_ids)).dropna(subset=['name']).reset_index()
+    mask = coins['_name_lc'].str.contains(search, regex=False) | coins['_sym_lc'].str.contains(search, regex=False)
+    return coins.loc[mask, 'id'].tolist()
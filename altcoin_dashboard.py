@@ -1,8 +1,18 @@
 import streamlit as st
 import pandas as pd
-import numpy as np
-import requests
-from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+from altcoin_core import (
+    EXPORT_WORKERS,
+    LiveState,
+    calculate_pair_beta,
+    calculate_volatility,
+    calculate_volatility_multiplier,
+    filter_coin_ids,
+    get_latest_ohlc,
+    get_ohlc_data,
+    prefetch_ohlc,
+)
 
 # ------------------- UI CONFIG (Fixed) ------------------- #
 st.set_page_config(
@@ -23,95 +33,43 @@ st.markdown("""
 st.title("📈 Altcoin Sensitivity Dashboard (ATR Upgraded)")
 st.caption("Volatility now matches TradingView's ATR(14)/Close method")
 
-# ------------------- API SETUP (Optimized) ------------------- #
-COINGECKO_API = "https://api.coingecko.com/api/v3"
-BINANCE_API = "https://api.binance.com/api/v3"
-
-@st.cache_data(ttl=3600)
-def get_all_coins():
-    """Fetch all CoinGecko coins with retry logic."""
-    try:
-        url = f"{COINGECKO_API}/coins/list"
-        r = requests.get(url, timeout=10)
-        r.raise_for_status()
-        return pd.DataFrame(r.json())
-    except Exception as e:
-        st.error(f"CoinGecko API error: {str(e)}")
-        return pd.DataFrame()
-
-def get_ohlc_data(coin_id, days=14):
-    """
-    Fetch OHLC data from CoinGecko → fallback to Binance if needed.
-    Returns: DataFrame with columns [timestamp, open, high, low, close]
-    """
-    try:
-        # Try CoinGecko first
-        url = f"{COINGECKO_API}/coins/{coin_id}/ohlc?vs_currency=usd&days={days}"
-        data = requests.get(url, timeout=10).json()
-        df = pd.DataFrame(data, columns=['timestamp', 'open', 'high', 'low', 'close'])
-        df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms')
-        return df
-    except:
-        # Fallback to Binance
-        symbol = "BTCUSDT" if coin_id == "bitcoin" else f"{coin_id.upper()}USDT"
-        end_time = datetime.now()
-        start_time = end_time - timedelta(days=days)
-        url = f"{BINANCE_API}/klines?symbol={symbol}&interval=1d&startTime={int(start_time.timestamp()*1000)}&endTime={int(end_time.timestamp()*1000)}"
-        data = requests.get(url).json()
-        df = pd.DataFrame(data, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume', 'close_time', 'quote_asset_volume', 'trades', 'taker_buy_volume', 'taker_buy_quote_volume', 'ignore'])
-        df = df[['timestamp', 'open', 'high', 'low', 'close']].astype(float)
-        df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms')
-        return df
-
-# ------------------- CORE CALCULATIONS (Upgraded) ------------------- #
-def calculate_true_range(high, low, prev_close):
-    """True Range for ATR calculation."""
-    return max(high - low, abs(high - prev_close), abs(low - prev_close))
-
-def calculate_atr(df, window=14):
-    """Calculate ATR(14) from OHLC data."""
-    df['prev_close'] = df['close'].shift(1)
-    df['TR'] = df.apply(lambda x: calculate_true_range(x['high'], x['low'], x['prev_close']), axis=1)
-    df['ATR'] = df['TR'].rolling(window).mean()
-    return df['ATR'].iloc[-1]  # Return latest ATR(14)
-
-def calculate_beta(btc_returns, alt_returns):
-    """Unchanged covariance/variance method."""
-    covariance = np.cov(alt_returns, btc_returns)[0][1]
-    btc_variance = np.var(btc_returns)
-    return covariance / btc_variance if btc_variance != 0 else 0
-
-def calculate_volatility_multiplier(btc_ohlc, alt_ohlc):
-    """TradingView-style: (ATR(14)/Close) for altcoin ÷ BTC."""
-    btc_atr = calculate_atr(btc_ohlc)
-    alt_atr = calculate_atr(alt_ohlc)
-    btc_vol = (btc_atr / btc_ohlc['close'].iloc[-1]) * 100
-    alt_vol = (alt_atr / alt_ohlc['close'].iloc[-1]) * 100
-    return alt_vol / btc_vol if btc_vol != 0 else 0
-
 # ------------------- UI LAYOUT (Debugged) ------------------- #
-all_coins = get_all_coins()
-
 with st.sidebar:
     st.header("Settings")
     mode = st.radio("Calculation Mode:", ["Beta", "Volatility Multiplier"], index=0)
     search = st.text_input("🔍 Search Coin (name/symbol)", key="search").lower()
-    filtered_coins = all_coins[all_coins['name'].str.contains(search, case=False) | all_coins['symbol'].str.contains(search, case=False)]
-    selected_coin = st.selectbox("Select Coin:", filtered_coins['id'].tolist(), key="coin_select")
+    coin_ids = filter_coin_ids(search)
+    if len(search) >= 3 and st.session_state.get("prefetched_search") != search:
+        # Hide the OHLC round trip for the likeliest picks behind the user's typing
+        # (only once the search is specific enough, so partial input doesn't fire requests)
+        st.session_state["prefetched_search"] = search
+        prefetch_ohlc(coin_ids[:5])
+    selected_coin = st.selectbox("Select Coin:", coin_ids, key="coin_select")
+    refresh = st.button("🔄 Refresh Latest Bar")
+
+live_states = st.session_state.setdefault("live_states", {})
+live_stats = st.session_state.setdefault("live_stats", {"hits": 0, "misses": 0})
 
 # ------------------- MAIN CALCULATIONS ------------------- #
 if selected_coin:
     with st.spinner(f"Calculating {selected_coin} {mode}..."):
         try:
-            btc_ohlc = get_ohlc_data("bitcoin")
-            alt_ohlc = get_ohlc_data(selected_coin)
-            
-            if mode == "Beta":
-                btc_returns = np.log(btc_ohlc['close'] / btc_ohlc['close'].shift(1)).dropna()
-                alt_returns = np.log(alt_ohlc['close'] / alt_ohlc['close'].shift(1)).dropna()
-                result = calculate_beta(btc_returns, alt_returns)
+            state = live_states.get(selected_coin)
+            if state is None:
+                # Session start (or new coin): full recompute seeds the streaming state
+                live_stats["misses"] += 1
+                state = live_states[selected_coin] = LiveState(get_ohlc_data("bitcoin"), get_ohlc_data(selected_coin))
+            elif refresh or state.is_stale():
+                # Fold in only bars newer than the state; the refresh button bypasses the OHLC caches
+                live_stats["misses"] += 1
+                fetch = get_latest_ohlc if refresh else get_ohlc_data
+                if not state.update(fetch("bitcoin"), fetch(selected_coin)):
+                    # New bars came from another source/interval (e.g. Binance 1d fallback): reseed instead of mixing
+                    state = live_states[selected_coin] = LiveState(get_ohlc_data("bitcoin"), get_ohlc_data(selected_coin))
             else:
-                result = calculate_volatility_multiplier(btc_ohlc, alt_ohlc)
+                # Plain widget reruns (e.g. BTC % Move) skip the cached-function lookups entirely
+                live_stats["hits"] += 1
+            result = state.result(mode)
             
             st.metric(label=f"{selected_coin.upper()} {mode}", value=round(result, 3))
             
@@ -123,22 +81,39 @@ if selected_coin:
         except Exception as e:
             st.error(f"Error calculating {mode}: {str(e)}")
 
+    total = live_stats["hits"] + live_stats["misses"]
+    if total:
+        st.sidebar.caption(f"Session cache hit rate: {live_stats['hits'] / total:.0%} ({live_stats['hits']}/{total})")
+
 # ------------------- CSV EXPORT (Fixed) ------------------- #
 if st.sidebar.button("📤 Export Data"):
     with st.spinner("Exporting..."):
         try:
-            coin_ids = filtered_coins['id'].tolist()
+            export_ids = coin_ids[:10]  # Limit to 10 coins to avoid rate limits
+            btc_ohlc = get_ohlc_data("bitcoin")
+            # BTC volatility is the same for every coin: compute it once
+            # (beta needs BTC re-aligned to each coin's timestamps, so it can't be shared)
+            if mode != "Beta":
+                btc_vol = calculate_volatility(btc_ohlc)
+
+            def fetch_coin(coin):
+                try:
+                    return get_ohlc_data(coin)
+                except Exception:
+                    return None
+
+            with ThreadPoolExecutor(max_workers=EXPORT_WORKERS) as ex:
+                coin_ohlcs = list(ex.map(fetch_coin, export_ids))
+
             export_data = []
-            for coin in coin_ids[:10]:  # Limit to 10 coins to avoid rate limits
+            for coin, coin_ohlc in zip(export_ids, coin_ohlcs):
+                if coin_ohlc is None:
+                    continue
                 try:
-                    btc_ohlc = get_ohlc_data("bitcoin")
-                    coin_ohlc = get_ohlc_data(coin)
                     if mode == "Beta":
-                        btc_returns = np.log(btc_ohlc['close'] / btc_ohlc['close'].shift(1)).dropna()
-                        coin_returns = np.log(coin_ohlc['close'] / coin_ohlc['close'].shift(1)).dropna()
-                        val = calculate_beta(btc_returns, coin_returns)
+                        val = calculate_pair_beta(btc_ohlc, coin_ohlc)
                     else:
-                        val = calculate_volatility_multiplier(btc_ohlc, coin_ohlc)
+                        val = calculate_volatility_multiplier(btc_ohlc, coin_ohlc, btc_vol=btc_vol)
                     export_data.append((coin, val))
                 except:
                     continue